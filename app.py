@@ -11,6 +11,10 @@ from flask import Flask, render_template, request, jsonify, Response
 import base64
 import numpy as np
 import random
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
 try:
     import cv2
@@ -25,8 +29,8 @@ except ImportError:
 app = Flask(__name__)
 
 class FaceAttendanceSystem:
-    def __init__(self):
-        self.database_path = "database"
+    def __init__(self, database_path="database"):
+        self.database_path = database_path
         self.encodings_file = f"{self.database_path}/face_encodings.pkl"
         self.attendance_file = f"{self.database_path}/attendance.json"
         
@@ -46,6 +50,9 @@ class FaceAttendanceSystem:
         # Check if face recognition is available
         self.face_recognition_available = face_recognition is not None and cv2 is not None
         
+        # Serializes change-and-save of the gallery and attendance files
+        self.lock = threading.Lock()
+        
     def load_encodings(self):
         """Load face encodings from database"""
         if os.path.exists(self.encodings_file):
@@ -97,15 +104,16 @@ class FaceAttendanceSystem:
         """
         if not self.face_recognition_available or image is None:
             # In demo mode or if image is None, just add the user without face encoding
-            if user_id in self.known_ids:
-                return False, f"User ID {user_id} already registered"
-            
-            # Generate a mock encoding (random array)
-            mock_encoding = np.random.rand(128)
-            self.known_encodings.append(mock_encoding)
-            self.known_names.append(name)
-            self.known_ids.append(user_id)
-            self.save_encodings()
+            with self.lock:
+                if user_id in self.known_ids:
+                    return False, f"User ID {user_id} already registered"
+                
+                # Generate a mock encoding (random array)
+                mock_encoding = np.random.rand(128)
+                self.known_encodings.append(mock_encoding)
+                self.known_names.append(name)
+                self.known_ids.append(user_id)
+                self.save_encodings()
             return True, f"User {name} registered successfully (Demo mode - Face recognition not available)"
         
         # Real face recognition mode
@@ -124,14 +132,15 @@ class FaceAttendanceSystem:
             if len(face_encodings) == 0:
                 return False, "Could not generate face encoding"
             
-            if user_id in self.known_ids:
-                return False, f"User ID {user_id} already registered"
-            
-            self.known_encodings.append(face_encodings[0])
-            self.known_names.append(name)
-            self.known_ids.append(user_id)
-            
-            self.save_encodings()
+            with self.lock:
+                if user_id in self.known_ids:
+                    return False, f"User ID {user_id} already registered"
+                
+                self.known_encodings.append(face_encodings[0])
+                self.known_names.append(name)
+                self.known_ids.append(user_id)
+                
+                self.save_encodings()
             return True, f"User {name} registered successfully"
         except Exception as e:
             print(f"Registration error: {e}")
@@ -258,36 +267,37 @@ class FaceAttendanceSystem:
         today = datetime.now().strftime("%Y-%m-%d")
         current_time = datetime.now().strftime("%H:%M:%S")
         
-        if today not in self.attendance_records:
-            self.attendance_records[today] = {}
-        
-        if user_id not in self.attendance_records[today]:
-            self.attendance_records[today][user_id] = {
-                "name": name,
-                "punch_in": None,
-                "punch_out": None,
-                "status": "absent"
-            }
-        
-        user_record = self.attendance_records[today][user_id]
-        
-        if action == "punch_in":
-            if user_record["punch_in"]:
-                return False, f"Already punched in at {user_record['punch_in']}"
-            user_record["punch_in"] = current_time
-            user_record["status"] = "present"
-            message = f"Punch-in recorded at {current_time}"
-        
-        elif action == "punch_out":
-            if not user_record["punch_in"]:
-                return False, "Cannot punch-out without punching in first"
-            if user_record["punch_out"]:
-                return False, f"Already punched out at {user_record['punch_out']}"
-            user_record["punch_out"] = current_time
-            message = f"Punch-out recorded at {current_time}"
-        
-        self.save_attendance()
-        return True, message
+        with self.lock:
+            if today not in self.attendance_records:
+                self.attendance_records[today] = {}
+            
+            if user_id not in self.attendance_records[today]:
+                self.attendance_records[today][user_id] = {
+                    "name": name,
+                    "punch_in": None,
+                    "punch_out": None,
+                    "status": "absent"
+                }
+            
+            user_record = self.attendance_records[today][user_id]
+            
+            if action == "punch_in":
+                if user_record["punch_in"]:
+                    return False, f"Already punched in at {user_record['punch_in']}"
+                user_record["punch_in"] = current_time
+                user_record["status"] = "present"
+                message = f"Punch-in recorded at {current_time}"
+            
+            elif action == "punch_out":
+                if not user_record["punch_in"]:
+                    return False, "Cannot punch-out without punching in first"
+                if user_record["punch_out"]:
+                    return False, f"Already punched out at {user_record['punch_out']}"
+                user_record["punch_out"] = current_time
+                message = f"Punch-out recorded at {current_time}"
+            
+            self.save_attendance()
+            return True, message
     
     def get_attendance_summary(self, date=None):
         """Get attendance summary for a specific date"""
@@ -299,8 +309,117 @@ class FaceAttendanceSystem:
         
         return self.attendance_records[date]
 
+class InvalidSiteError(ValueError):
+    """Raised when a site id is not a valid directory name"""
+
+class UnknownSiteError(LookupError):
+    """Raised when a site has no stored gallery and is not being created"""
+
+class TenantRegistry:
+    """
+    Per-site attendance systems, loaded lazily and evicted least-recently-used
+    Each site gets its own gallery and attendance store under database/sites/<site_id>;
+    requests without a site id use the original database directory
+    """
+    site_id_pattern = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+    def __init__(self, base_path="database", max_tenants=8):
+        self.base_path = base_path
+        self.max_tenants = max_tenants
+        self.tenants = OrderedDict()
+        self.in_use = {}
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def site_path(self, site_id):
+        """Resolve the database directory for a site (None means the default site)"""
+        if site_id is None:
+            return self.base_path
+        if not isinstance(site_id, str) or not self.site_id_pattern.fullmatch(site_id):
+            raise InvalidSiteError(f"Invalid site id: {site_id!r}")
+        return os.path.join(self.base_path, "sites", site_id)
+
+    @contextmanager
+    def use(self, site_id=None, create=False):
+        """
+        Yield the attendance system for a site, loading it on first use
+        The site stays pinned (never evicted) until the block exits, so only
+        one live instance exists per site. Unknown sites are only created
+        when create=True; otherwise UnknownSiteError is raised.
+        """
+        path = self.site_path(site_id)
+        system = self.acquire(path, site_id is None or create)
+        try:
+            yield system
+        finally:
+            self.release(path)
+
+    def acquire(self, path, create):
+        """Pin the system for path, loading it outside the registry lock if needed"""
+        while True:
+            with self.lock:
+                if path in self.tenants:
+                    self.tenants.move_to_end(path)
+                    self.in_use[path] += 1
+                    return self.tenants[path]
+                
+                loaded = self.loading.get(path)
+                if loaded is None:
+                    if not create and not os.path.isdir(path):
+                        raise UnknownSiteError(f"Unknown site: {os.path.basename(path)}")
+                    loaded = self.loading[path] = threading.Event()
+                    break
+            
+            # Another request is loading this site; wait and look again
+            loaded.wait()
+        
+        try:
+            system = FaceAttendanceSystem(path)
+        except Exception:
+            with self.lock:
+                del self.loading[path]
+            loaded.set()
+            raise
+        
+        with self.lock:
+            self.tenants[path] = system
+            self.in_use[path] = 1
+            del self.loading[path]
+            self.evict_idle()
+        loaded.set()
+        return system
+
+    def release(self, path):
+        """Unpin a site and evict idle sites over the limit"""
+        with self.lock:
+            self.in_use[path] -= 1
+            self.evict_idle()
+
+    def evict_idle(self):
+        """Drop least recently used sites that are not in use (caller holds self.lock)"""
+        idle = [path for path in self.tenants if self.in_use[path] == 0]
+        while len(self.tenants) > self.max_tenants and idle:
+            evicted_path = idle.pop(0)
+            del self.tenants[evicted_path]
+            del self.in_use[evicted_path]
+            print(f"Evicted idle site: {evicted_path}")
+
 # Initialize the system
-attendance_system = FaceAttendanceSystem()
+tenants = TenantRegistry(max_tenants=int(os.environ.get('MAX_ACTIVE_SITES', 8)))
+
+def get_site_id(data=None):
+    """Read the site id from the JSON body or query string"""
+    if isinstance(data, dict) and data.get('site_id') is not None:
+        return data['site_id']
+    return request.args.get('site_id')
+
+@app.errorhandler(InvalidSiteError)
+def invalid_site(e):
+    return jsonify({'success': False, 'error': str(e), 'message': str(e)}), 400
+
+@app.errorhandler(UnknownSiteError)
+def unknown_site(e):
+    return jsonify({'success': False, 'error': str(e), 'message': str(e)}), 404
 
 @app.route('/')
 def index():
@@ -309,11 +428,12 @@ def index():
 @app.route('/status')
 def status():
     """Check system status"""
-    return jsonify({
-        'face_recognition_available': attendance_system.face_recognition_available,
-        'mode': 'Real' if attendance_system.face_recognition_available else 'Demo',
-        'message': 'Face recognition is available' if attendance_system.face_recognition_available else 'Running in demo mode - install dlib for real face recognition'
-    })
+    with tenants.use(get_site_id()) as attendance_system:
+        return jsonify({
+            'face_recognition_available': attendance_system.face_recognition_available,
+            'mode': 'Real' if attendance_system.face_recognition_available else 'Demo',
+            'message': 'Face recognition is available' if attendance_system.face_recognition_available else 'Running in demo mode - install dlib for real face recognition'
+        })
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -323,36 +443,38 @@ def register():
         name = data.get('name')
         user_id = data.get('user_id')
         image_data = data.get('image')
-        
-        print(f"Registration request: name={name}, user_id={user_id}, image_data_length={len(image_data) if image_data else 0}")
-        
-        # Decode base64 image if face recognition is available
-        image = None
-        if attendance_system.face_recognition_available and image_data:
-            try:
-                # Remove the data:image/jpeg;base64, prefix if present
-                if ',' in image_data:
-                    image_bytes = base64.b64decode(image_data.split(',')[1])
-                else:
-                    image_bytes = base64.b64decode(image_data)
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                if image is not None:
-                    print(f"Image decoded successfully: shape={image.shape}")
-                else:
-                    print("Image decoding returned None")
-            except Exception as e:
-                print(f"Image decoding error: {e}")
-                pass
-        
-        success, message = attendance_system.register_user(name, user_id, image)
-        
-        print(f"Registration result: success={success}, message={message}")
-        
-        return jsonify({
-            'success': success,
-            'message': message
-        })
+        with tenants.use(get_site_id(data), create=True) as attendance_system:
+            print(f"Registration request: name={name}, user_id={user_id}, image_data_length={len(image_data) if image_data else 0}")
+            
+            # Decode base64 image if face recognition is available
+            image = None
+            if attendance_system.face_recognition_available and image_data:
+                try:
+                    # Remove the data:image/jpeg;base64, prefix if present
+                    if ',' in image_data:
+                        image_bytes = base64.b64decode(image_data.split(',')[1])
+                    else:
+                        image_bytes = base64.b64decode(image_data)
+                    nparr = np.frombuffer(image_bytes, np.uint8)
+                    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                    if image is not None:
+                        print(f"Image decoded successfully: shape={image.shape}")
+                    else:
+                        print("Image decoding returned None")
+                except Exception as e:
+                    print(f"Image decoding error: {e}")
+                    pass
+            
+            success, message = attendance_system.register_user(name, user_id, image)
+            
+            print(f"Registration result: success={success}, message={message}")
+            
+            return jsonify({
+                'success': success,
+                'message': message
+            })
+    except (InvalidSiteError, UnknownSiteError):
+        raise
     except Exception as e:
         print(f"Register endpoint error: {e}")
         import traceback
@@ -368,36 +490,38 @@ def identify():
     try:
         data = request.json
         image_data = data.get('image')
-        
-        frame = None
-        if attendance_system.face_recognition_available and image_data:
-            try:
-                # Remove the data:image/jpeg;base64, prefix if present
-                if ',' in image_data:
-                    image_bytes = base64.b64decode(image_data.split(',')[1])
-                else:
-                    image_bytes = base64.b64decode(image_data)
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                if frame is not None:
-                    print(f"Image decoded successfully: shape={frame.shape}")
-                else:
-                    print("Image decoding returned None")
-            except Exception as e:
-                print(f"Image decoding error: {e}")
-                pass
-        
-        name, user_id, confidence, is_real = attendance_system.identify_face(frame)
-        
-        print(f"Identification result: name={name}, user_id={user_id}, confidence={confidence}, is_real={is_real}")
-        
-        return jsonify({
-            'name': name,
-            'user_id': user_id,
-            'confidence': float(confidence) if confidence else 0,
-            'is_real': bool(is_real) if is_real is not None else False,
-            'identified': user_id is not None
-        })
+        with tenants.use(get_site_id(data)) as attendance_system:
+            frame = None
+            if attendance_system.face_recognition_available and image_data:
+                try:
+                    # Remove the data:image/jpeg;base64, prefix if present
+                    if ',' in image_data:
+                        image_bytes = base64.b64decode(image_data.split(',')[1])
+                    else:
+                        image_bytes = base64.b64decode(image_data)
+                    nparr = np.frombuffer(image_bytes, np.uint8)
+                    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                    if frame is not None:
+                        print(f"Image decoded successfully: shape={frame.shape}")
+                    else:
+                        print("Image decoding returned None")
+                except Exception as e:
+                    print(f"Image decoding error: {e}")
+                    pass
+            
+            name, user_id, confidence, is_real = attendance_system.identify_face(frame)
+            
+            print(f"Identification result: name={name}, user_id={user_id}, confidence={confidence}, is_real={is_real}")
+            
+            return jsonify({
+                'name': name,
+                'user_id': user_id,
+                'confidence': float(confidence) if confidence else 0,
+                'is_real': bool(is_real) if is_real is not None else False,
+                'identified': user_id is not None
+            })
+    except (InvalidSiteError, UnknownSiteError):
+        raise
     except Exception as e:
         print(f"Identify endpoint error: {e}")
         return jsonify({
@@ -413,13 +537,15 @@ def mark_attendance():
         user_id = data.get('user_id')
         name = data.get('name')
         action = data.get('action', 'punch_in')
-        
-        success, message = attendance_system.mark_attendance(user_id, name, action)
-        
-        return jsonify({
-            'success': success,
-            'message': message
-        })
+        with tenants.use(get_site_id(data)) as attendance_system:
+            success, message = attendance_system.mark_attendance(user_id, name, action)
+            
+            return jsonify({
+                'success': success,
+                'message': message
+            })
+    except (InvalidSiteError, UnknownSiteError):
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -434,22 +560,25 @@ def test_face_recognition():
         import cv2
         import numpy as np
         
-        # Test basic functionality
-        test_image = np.zeros((100, 100, 3), dtype=np.uint8)
-        test_image[25:75, 25:75] = [255, 255, 255]  # White square
-        
-        # Test face detection (should return empty)
-        locations = face_recognition.face_locations(test_image)
-        
-        return jsonify({
-            'status': 'Face recognition libraries loaded successfully',
-            'face_recognition_version': face_recognition.__version__ if hasattr(face_recognition, '__version__') else 'unknown',
-            'opencv_version': cv2.__version__,
-            'numpy_version': np.__version__,
-            'face_detection_test': f'Found {len(locations)} faces in test image (expected 0)',
-            'face_recognition_available': attendance_system.face_recognition_available,
-            'known_users_count': len(attendance_system.known_ids)
-        })
+        with tenants.use(get_site_id()) as attendance_system:
+            # Test basic functionality
+            test_image = np.zeros((100, 100, 3), dtype=np.uint8)
+            test_image[25:75, 25:75] = [255, 255, 255]  # White square
+            
+            # Test face detection (should return empty)
+            locations = face_recognition.face_locations(test_image)
+            
+            return jsonify({
+                'status': 'Face recognition libraries loaded successfully',
+                'face_recognition_version': face_recognition.__version__ if hasattr(face_recognition, '__version__') else 'unknown',
+                'opencv_version': cv2.__version__,
+                'numpy_version': np.__version__,
+                'face_detection_test': f'Found {len(locations)} faces in test image (expected 0)',
+                'face_recognition_available': attendance_system.face_recognition_available,
+                'known_users_count': len(attendance_system.known_ids)
+            })
+    except (InvalidSiteError, UnknownSiteError):
+        raise
     except Exception as e:
         return jsonify({
             'status': 'Error testing face recognition',
@@ -460,23 +589,25 @@ def test_face_recognition():
 def get_attendance_summary():
     """API endpoint for getting attendance summary"""
     date = request.args.get('date', None)
-    summary = attendance_system.get_attendance_summary(date)
+    with tenants.use(get_site_id()) as attendance_system:
+        summary = attendance_system.get_attendance_summary(date)
     return jsonify(summary)
 
 @app.route('/users')
 def get_users():
     """Get list of registered users"""
     users = []
-    for i, user_id in enumerate(attendance_system.known_ids):
-        users.append({
-            'id': user_id,
-            'name': attendance_system.known_names[i]
-        })
+    with tenants.use(get_site_id()) as attendance_system:
+        for i, user_id in enumerate(attendance_system.known_ids):
+            users.append({
+                'id': user_id,
+                'name': attendance_system.known_names[i]
+            })
     return jsonify(users)
 
 if __name__ == '__main__':
     print("Starting Face Authentication Attendance System...")
-    if attendance_system.face_recognition_available:
+    if face_recognition is not None and cv2 is not None:
         print("✓ Face recognition is available")
     else:
         print("⚠ Face recognition library not available - Running in DEMO mode")
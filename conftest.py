@@ -0,0 +1,2 @@
+# test.py is a standalone environment check script, not a pytest module
+collect_ignore = ["test.py"]
@@ -0,0 +1,135 @@
+"""
+Tests for per-site partitioning of galleries and attendance stores
+"""
+
+import json
+import os
+
+import pytest
+
+import app
+from app import TenantRegistry, InvalidSiteError, UnknownSiteError
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return TenantRegistry(base_path=str(tmp_path), max_tenants=2)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "tenants", TenantRegistry(base_path=str(tmp_path), max_tenants=2))
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("site_id", ["../x", "a/b", "", "a b", "x" * 65])
+def test_invalid_site_id_rejected(registry, site_id):
+    with pytest.raises(InvalidSiteError):
+        registry.site_path(site_id)
+
+
+def test_trailing_newline_rejected(registry, tmp_path):
+    with pytest.raises(InvalidSiteError):
+        with registry.use("abc\n", create=True):
+            pass
+    assert not (tmp_path / "sites").exists()
+
+
+@pytest.mark.parametrize("site_id", [0, False, 1, ["s1"]])
+def test_non_string_site_id_rejected(registry, site_id):
+    with pytest.raises(InvalidSiteError):
+        registry.site_path(site_id)
+
+
+def test_none_is_default_site(registry, tmp_path):
+    assert registry.site_path(None) == str(tmp_path)
+    with registry.use() as system:
+        assert system.database_path == str(tmp_path)
+
+
+def test_unknown_site_not_created(registry, tmp_path):
+    with pytest.raises(UnknownSiteError):
+        with registry.use("typo"):
+            pass
+    assert not (tmp_path / "sites" / "typo").exists()
+    assert len(registry.tenants) == 0
+
+
+def test_sites_are_isolated(registry):
+    with registry.use("s1", create=True) as s1:
+        assert s1.register_user("Alice", "1", None)[0]
+    with registry.use("s2", create=True) as s2:
+        assert s2.register_user("Bob", "1", None)[0]
+        assert s2.known_names == ["Bob"]
+
+
+def test_lru_eviction_order(registry, tmp_path):
+    for site_id in ["s1", "s2"]:
+        with registry.use(site_id, create=True):
+            pass
+    with registry.use("s1"):
+        pass
+    with registry.use("s3", create=True):
+        pass
+    assert list(registry.tenants) == [
+        os.path.join(str(tmp_path), "sites", "s1"),
+        os.path.join(str(tmp_path), "sites", "s3"),
+    ]
+
+
+def test_evicted_site_reloads_from_disk(registry):
+    with registry.use("s1", create=True) as s1:
+        s1.register_user("Alice", "1", None)
+    for site_id in ["s2", "s3"]:
+        with registry.use(site_id, create=True):
+            pass
+    with registry.use("s1") as reloaded:
+        assert reloaded is not s1
+        assert reloaded.known_ids == ["1"]
+
+
+def test_site_in_use_is_not_evicted(tmp_path):
+    registry = TenantRegistry(base_path=str(tmp_path), max_tenants=1)
+    with registry.use("s1", create=True) as old:
+        old.register_user("Alice", "1", None)
+        old.register_user("Bob", "2", None)
+        with registry.use("s2", create=True):
+            pass
+        with registry.use("s1") as new:
+            assert new is old
+            new.mark_attendance("2", "Bob")
+        old.mark_attendance("1", "Alice")
+
+    with open(tmp_path / "sites" / "s1" / "attendance.json") as f:
+        records = json.load(f)
+    (day,) = records.values()
+    assert set(day) == {"1", "2"}
+
+
+def test_routes_by_body_and_query(client):
+    response = client.post("/register", json={"name": "Alice", "user_id": "1", "site_id": "s1"})
+    assert response.get_json()["success"]
+
+    assert client.get("/users?site_id=s1").get_json() == [{"id": "1", "name": "Alice"}]
+    assert client.get("/users").get_json() == []
+
+    # The body takes precedence over the query string
+    response = client.post("/mark_attendance?site_id=other", json={"name": "Alice", "user_id": "1", "site_id": "s1"})
+    assert response.get_json()["success"]
+
+
+def test_unknown_site_is_404(client):
+    assert client.get("/users?site_id=typo").status_code == 404
+    assert client.post("/identify", json={"image": None, "site_id": "typo"}).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/status", "/users", "/attendance_summary"])
+def test_invalid_site_is_400(client, path):
+    response = client.get(f"{path}?site_id=../x")
+    assert response.status_code == 400
+    assert "Invalid site id" in response.get_json()["error"]
+
+
+def test_invalid_body_site_is_400(client):
+    response = client.post("/register", json={"name": "A", "user_id": "1", "site_id": 0})
+    assert response.status_code == 400